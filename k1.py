@@ -1,12 +1,16 @@
-import requests
+import aiohttp
+import aiosqlite
+import asyncio
+import orjson
 import logging
 from telegram import Update
 from telegram.ext import Application, CommandHandler, CallbackContext, JobQueue
-import sqlite3
 from sqlite3 import Error
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
-import pytz
+from zoneinfo import ZoneInfo
 import os
+import time
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -20,43 +24,239 @@ TOKEN = TELEGRAM_TOKEN
 # Replace with the Kaspa API base URL
 KASPA_API_BASE_URL = 'https://api.kaspa.org/addresses'
 KASPA_PRICE_API_URL = 'https://api.kaspa.org/info/price'
+# Websocket endpoint for server-pushed new blocks
+KASPA_WS_URL = 'wss://api.kaspa.org/ws'
+# Delay between websocket reconnect attempts, in seconds
+WS_RECONNECT_DELAY = 5
+# SQLite database file
+DB_FILE = 'wallets.db'
+# Number of pooled reader connections
+READ_POOL_SIZE = 5
+# Cap on concurrent in-flight API requests, so large fan-outs back-pressure
+# instead of tripping upstream rate limits or exhausting sockets
+API_CONCURRENCY = 20
+# Per-request timeout in seconds, so a hung API cannot stall a handler indefinitely
+REQUEST_TIMEOUT = 5
+# Retry budget and backoff factor for transient API failures
+REQUEST_RETRIES = 3
+REQUEST_BACKOFF = 0.3
 # Polling interval in seconds
 POLLING_INTERVAL = 60
-# Eastern Timezone
+# How long a fetched KAS price stays fresh, in seconds
+PRICE_CACHE_TTL = 5.0
+# Eastern Timezone, resolved once at import instead of per formatted transaction
 TIMEZONE = 'US/Eastern'
+_TZ = ZoneInfo(TIMEZONE)
 
 # Enable logging
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize SQLite database
-def create_connection(db_file):
+# SQLite connections: one exclusive writer plus a small pool of readers.
+# WAL mode (set per connection below) lets the readers run alongside the writer.
+write_conn = None
+read_pool = None
+
+async def create_connection(db_file):
     """ create a database connection to the SQLite database specified by db_file """
     conn = None
     try:
-        conn = sqlite3.connect(db_file)
+        # BEGIN IMMEDIATE transactions take the write lock upfront to avoid SQLITE_BUSY
+        conn = await aiosqlite.connect(db_file, isolation_level='IMMEDIATE')
+        # WAL allows readers alongside a writer; synchronous=NORMAL cuts fsyncs per commit
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        await conn.execute("PRAGMA busy_timeout=5000")
+        await conn.execute("PRAGMA temp_store=MEMORY")
+        await conn.execute("PRAGMA cache_size=-65536")
     except Error as e:
         logger.error(f"Error creating connection to database: {e}")
     return conn
 
-def create_table(conn):
+async def create_table(conn):
     """ create tables if they don't exist """
     try:
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS wallets (
+        await conn.execute('''CREATE TABLE IF NOT EXISTS wallets (
                         id INTEGER PRIMARY KEY,
                         user_id INTEGER NOT NULL,
+                        chat_id INTEGER,
                         wallet_address TEXT NOT NULL
                     )''')
-        conn.commit()
+        # Cover the WHERE user_id=? AND wallet_address=? / WHERE wallet_address=? lookups
+        await conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_wallets_user_addr ON wallets(user_id, wallet_address)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_wallets_addr ON wallets(wallet_address)")
+        # Notification target and per-wallet polling state live with the rows;
+        # guarded ALTERs bring databases created before these columns up to date
+        for column in ("chat_id INTEGER", "last_count INTEGER", "last_tx_id TEXT", "last_etag TEXT"):
+            try:
+                await conn.execute(f"ALTER TABLE wallets ADD COLUMN {column}")
+            except Error:
+                pass  # column already exists
+        await conn.commit()
     except Error as e:
         logger.error(f"Error creating table: {e}")
 
-conn = create_connection("wallets.db")
-create_table(conn)
+async def create_db_pool(application) -> None:
+    """ open the writer connection and fill the reader pool """
+    global write_conn, read_pool
+    write_conn = await create_connection(DB_FILE)
+    await create_table(write_conn)
+
+    read_pool = asyncio.Queue()
+    for _ in range(READ_POOL_SIZE):
+        read_pool.put_nowait(await create_connection(DB_FILE))
+
+    await load_wallet_subscribers()
+    logger.info(f"Opened SQLite writer connection and {READ_POOL_SIZE} pooled readers")
+
+async def close_db_pool(application) -> None:
+    """ close the writer connection and all pooled readers on shutdown """
+    if write_conn:
+        await write_conn.close()
+    if read_pool:
+        while not read_pool.empty():
+            await (read_pool.get_nowait()).close()
+    logger.info("Closed SQLite connections")
+
+@asynccontextmanager
+async def read_conn():
+    """ borrow a reader connection from the pool """
+    conn = await read_pool.get()
+    try:
+        yield conn
+    finally:
+        read_pool.put_nowait(conn)
+
+# Reverse index from wallet address to subscribed chat ids, kept in sync with the wallets table
+wallet_subscribers = {}
+
+async def load_wallet_subscribers():
+    """ populate the wallet -> chat ids index from the wallets table """
+    wallet_subscribers.clear()
+    try:
+        async with read_conn() as conn:
+            # Rows from before the chat_id column fall back to the user's private chat
+            c = await conn.execute("SELECT wallet_address, COALESCE(chat_id, user_id) FROM wallets")
+            for wallet_address, chat_id in await c.fetchall():
+                wallet_subscribers.setdefault(wallet_address, set()).add(chat_id)
+    except Error as e:
+        logger.error(f"Error loading wallet subscribers: {e}")
+
+# Shared aiohttp session, created on startup and closed on shutdown
+session = None
+
+async def create_session(application) -> None:
+    """ create the shared aiohttp session used by all API helpers """
+    global session
+    session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=API_CONCURRENCY, limit_per_host=0, ttl_dns_cache=300, force_close=False),
+        timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+        headers={'Accept-Encoding': 'gzip'},
+    )
+    logger.info("Created shared aiohttp session")
 
-last_transactions = {}
-last_transaction_counts = {}
+# Bounds in-flight API requests alongside the connector limit
+API_SEM = asyncio.Semaphore(API_CONCURRENCY)
+
+async def api_get(url: str, **kwargs):
+    """ GET through the shared session, retrying transient failures with backoff
+
+    Returns (status, body, headers) with the body fully read, so the retry
+    covers truncated or timed-out body reads as well as connection errors.
+    """
+    for attempt in range(REQUEST_RETRIES):
+        try:
+            async with API_SEM:
+                async with session.get(url, **kwargs) as response:
+                    return response.status, await response.read(), response.headers
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == REQUEST_RETRIES - 1:
+                raise
+            logger.warning(f"Retrying GET {url} after error: {e}")
+            await asyncio.sleep(REQUEST_BACKOFF * 2 ** attempt)
+
+async def close_session(application) -> None:
+    """ close the shared aiohttp session on shutdown """
+    if session:
+        await session.close()
+        logger.info("Closed shared aiohttp session")
+
+# Background task subscribed to new blocks, started on startup
+block_watcher = None
+
+async def watch_blocks(application) -> None:
+    """ subscribe to new blocks over the websocket and notify on matching outputs
+
+    Sub-second push notifications replace most of the polling work; the 60s
+    polling tick stays as a fallback covering reconnection windows.
+    """
+    while True:
+        try:
+            async with session.ws_connect(KASPA_WS_URL, heartbeat=30) as ws:
+                await ws.send_json({'method': 'subscribe', 'params': ['new-block']})
+                logger.info("Subscribed to new blocks over websocket")
+                async for msg in ws:
+                    if msg.type != aiohttp.WSMsgType.TEXT:
+                        continue
+                    try:
+                        await notify_block_matches(application.bot, orjson.loads(msg.data))
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        # A bad frame or failed lookup only affects this block;
+                        # the connection itself is still healthy
+                        logger.error(f"Error processing block message: {e}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Websocket connection lost, reconnecting in {WS_RECONNECT_DELAY}s: {e}")
+        await asyncio.sleep(WS_RECONNECT_DELAY)
+
+async def notify_block_matches(bot, block) -> None:
+    """ notify subscribers of block transactions paying a tracked wallet """
+    for tx in block.get('transactions', ()):
+        # Total the amounts paid to each tracked address in this transaction
+        matched = {}
+        for output in tx.get('outputs', ()):
+            address = output.get('script_public_key_address')
+            if address in wallet_subscribers:
+                matched[address] = matched.get(address, 0) + output.get('amount', 0)
+        if not matched:
+            continue
+
+        price = await get_kas_price()
+        for address, sompi in matched.items():
+            amount_in_kas = sompi / 1_0000_0000
+            text = (
+                f"New transaction detected:\n"
+                f"Transaction ID: {tx.get('transaction_id')}\n"
+                f"Amount: {amount_in_kas:.6f} KAS (~${amount_in_kas * price:.2f})"
+            )
+            # Notify all subscribers concurrently; one unreachable chat must not drop
+            # the rest of the block's notifications or tear down the websocket
+            results = await asyncio.gather(
+                *(bot.send_message(chat_id=chat_id, text=text) for chat_id in wallet_subscribers.get(address, ())),
+                return_exceptions=True,
+            )
+            for send_error in (r for r in results if isinstance(r, Exception)):
+                logger.error(f"Error notifying subscriber of wallet {address}: {send_error}")
+
+        # Record the notified transaction so the polling tick doesn't re-send it
+        await write_conn.executemany("UPDATE wallets SET last_tx_id=? WHERE wallet_address=?",
+                                     [(tx.get('transaction_id'), address) for address in matched])
+        await write_conn.commit()
+
+async def on_startup(application) -> None:
+    global block_watcher
+    await create_session(application)
+    await create_db_pool(application)
+    block_watcher = asyncio.create_task(watch_blocks(application))
+
+async def on_shutdown(application) -> None:
+    if block_watcher:
+        block_watcher.cancel()
+    await close_db_pool(application)
+    await close_session(application)
 
 async def start(update: Update, context: CallbackContext) -> None:
     logger.info("Received /start command")
@@ -84,42 +284,33 @@ async def track_wallet(update: Update, context: CallbackContext) -> None:
 
         wallet_address = context.args[0]
         user_id = update.message.from_user.id
+        chat_id = update.message.chat_id
 
-        # Check if the wallet already exists for the user
-        with conn:
-            c = conn.cursor()
-            c.execute("SELECT * FROM wallets WHERE user_id=? AND wallet_address=?", (user_id, wallet_address))
-            result = c.fetchone()
-            if result:
-                await update.message.reply_text(f"You are already tracking wallet: {wallet_address}")
-                return
+        # One statement, one commit: the unique index makes a duplicate a no-op
+        c = await write_conn.execute("INSERT OR IGNORE INTO wallets (user_id, chat_id, wallet_address) VALUES (?, ?, ?)", (user_id, chat_id, wallet_address))
+        await write_conn.commit()
+        if c.rowcount == 0:
+            await update.message.reply_text(f"You are already tracking wallet: {wallet_address}")
+            return
 
         await update.message.reply_text(f"Tracking wallet: {wallet_address}")
-
-        # Save wallet to database
-        with conn:
-            c = conn.cursor()
-            c.execute("INSERT INTO wallets (user_id, wallet_address) VALUES (?, ?)", (user_id, wallet_address))
-            conn.commit()
+        wallet_subscribers.setdefault(wallet_address, set()).add(chat_id)
 
         # Fetch initial balance and transactions
-        balance = get_wallet_balance(wallet_address)
-        price = get_kas_price()
+        balance = await get_wallet_balance(wallet_address)
+        price = await get_kas_price()
         balance_in_usd = float(balance) * price
         await update.message.reply_text(f'Current balance: {balance} KAS (~${balance_in_usd:.2f})')
 
-        transactions = get_wallet_transactions(wallet_address)
-        last_transactions[wallet_address] = transactions
-
-        transaction_count = get_transaction_count(wallet_address)
-        last_transaction_counts[wallet_address] = transaction_count
+        transactions = await get_wallet_transactions(wallet_address)
 
-        await update.message.reply_text(f'Initial transactions:\n{format_transactions(transactions[:10])}')
+        transaction_count, etag = await get_transaction_count(wallet_address)
+        last_tx_id = transactions[0]['transaction_id'] if transactions else None
+        await write_conn.execute("UPDATE wallets SET last_count=?, last_tx_id=?, last_etag=? WHERE wallet_address=?",
+                                 (transaction_count, last_tx_id, etag, wallet_address))
+        await write_conn.commit()
 
-        # Schedule periodic checks
-        job_queue = context.job_queue
-        job_queue.run_repeating(check_transactions, interval=POLLING_INTERVAL, data={'chat_id': update.message.chat_id, 'wallet_address': wallet_address})
-        logger.info(f"Scheduled job to check transactions for wallet: {wallet_address}")
+        await update.message.reply_text(f'Initial transactions:\n{format_transactions(transactions[:10], price)}')
 
     except Exception as e:
         logger.error(f"Error in track_wallet command: {str(e)}")
@@ -133,10 +324,17 @@ async def delete_wallet(update: Update, context: CallbackContext) -> None:
         wallet_address = context.args[0]
         user_id = update.message.from_user.id
 
-        with conn:
-            c = conn.cursor()
-            c.execute("DELETE FROM wallets WHERE user_id=? AND wallet_address=?", (user_id, wallet_address))
-            conn.commit()
+        # The row's chat_id is the subscriber entry to drop from the reverse index
+        c = await write_conn.execute("SELECT COALESCE(chat_id, user_id) FROM wallets WHERE user_id=? AND wallet_address=?", (user_id, wallet_address))
+        row = await c.fetchone()
+        await write_conn.execute("DELETE FROM wallets WHERE user_id=? AND wallet_address=?", (user_id, wallet_address))
+        await write_conn.commit()
+
+        subscribers = wallet_subscribers.get(wallet_address)
+        if row and subscribers:
+            subscribers.discard(row[0])
+            if not subscribers:
+                del wallet_subscribers[wallet_address]
 
         await update.message.reply_text(f"Stopped tracking wallet: {wallet_address}")
 
@@ -153,10 +351,21 @@ async def edit_wallet(update: Update, context: CallbackContext) -> None:
         new_wallet_address = context.args[1]
         user_id = update.message.from_user.id
 
-        with conn:
-            c = conn.cursor()
-            c.execute("UPDATE wallets SET wallet_address=? WHERE user_id=? AND wallet_address=?", (new_wallet_address, user_id, old_wallet_address))
-            conn.commit()
+        # The row's chat_id moves with it between reverse-index entries
+        c = await write_conn.execute("SELECT COALESCE(chat_id, user_id) FROM wallets WHERE user_id=? AND wallet_address=?", (user_id, old_wallet_address))
+        row = await c.fetchone()
+        # Clear the old wallet's polling state so the next tick re-seeds it for the new address
+        await write_conn.execute("UPDATE wallets SET wallet_address=?, last_count=NULL, last_tx_id=NULL, last_etag=NULL WHERE user_id=? AND wallet_address=?",
+                                 (new_wallet_address, user_id, old_wallet_address))
+        await write_conn.commit()
+
+        if row:
+            subscribers = wallet_subscribers.get(old_wallet_address)
+            if subscribers:
+                subscribers.discard(row[0])
+                if not subscribers:
+                    del wallet_subscribers[old_wallet_address]
+            wallet_subscribers.setdefault(new_wallet_address, set()).add(row[0])
 
         await update.message.reply_text(f"Updated wallet from {old_wallet_address} to {new_wallet_address}")
 
@@ -166,19 +375,28 @@ async def edit_wallet(update: Update, context: CallbackContext) -> None:
 async def list_wallets(update: Update, context: CallbackContext) -> None:
     try:
         user_id = update.message.from_user.id
-        with conn:
-            c = conn.cursor()
-            c.execute("SELECT wallet_address FROM wallets WHERE user_id=?", (user_id,))
-            wallets = c.fetchall()
+        async with read_conn() as conn:
+            c = await conn.execute("SELECT wallet_address FROM wallets WHERE user_id=?", (user_id,))
+            wallets = await c.fetchall()
 
         if wallets:
+            # Fetch the price and all balances concurrently instead of one per round-trip
+            price_task = asyncio.create_task(get_kas_price())
+            balances = await asyncio.gather(*(get_wallet_balance(wallet[0]) for wallet in wallets), return_exceptions=True)
+            price = await price_task
+
             wallet_list = []
-            price = get_kas_price()
-            for wallet in wallets:
+            for wallet, balance in zip(wallets, balances):
                 wallet_address = wallet[0]
-                balance = get_wallet_balance(wallet_address)
-                balance_in_usd = float(balance) * price
-                wallet_list.append(f"{wallet_address} (Balance: {balance} KAS (~${balance_in_usd:.2f}))")
+                if isinstance(balance, Exception):
+                    logger.error(f"Error fetching balance for wallet {wallet_address}: {balance}")
+                    wallet_list.append(f"{wallet_address} (Balance: Error fetching balance)")
+                    continue
+                try:
+                    balance_in_usd = float(balance) * price
+                    wallet_list.append(f"{wallet_address} (Balance: {balance} KAS (~${balance_in_usd:.2f}))")
+                except ValueError:
+                    wallet_list.append(f"{wallet_address} (Balance: {balance})")
 
             await update.message.reply_text(f"Tracked wallets:\n" + "\n".join(wallet_list))
         else:
@@ -195,33 +413,48 @@ async def history(update: Update, context: CallbackContext) -> None:
         wallet_address = context.args[0]
 
         # Fetch the 10 most recent transactions
-        transactions = get_wallet_transactions(wallet_address)
+        transactions = await get_wallet_transactions(wallet_address)
         if transactions:
-            await update.message.reply_text(f'10 Most Recent Transactions:\n{format_transactions(transactions)}')
+            price = await get_kas_price()
+            await update.message.reply_text(f'10 Most Recent Transactions:\n{format_transactions(transactions, price)}')
         else:
             await update.message.reply_text(f"No transactions found for wallet: {wallet_address}")
     except Exception as e:
         logger.error(f"Error in history command: {str(e)}")
 
-def get_wallet_balance(wallet_address: str) -> str:
-    response = requests.get(f'{KASPA_API_BASE_URL}/{wallet_address}/balance')
-    if response.status_code == 200:
-        data = response.json()
+async def get_wallet_balance(wallet_address: str) -> str:
+    status, body, _ = await api_get(f'{KASPA_API_BASE_URL}/{wallet_address}/balance')
+    if status == 200:
+        data = orjson.loads(body)
         balance = data.get('balance', '0')
         balance_with_decimal = format_balance(balance)
         return balance_with_decimal
     else:
-        logger.error(f"Error fetching balance for wallet {wallet_address}: {response.status_code}")
+        logger.error(f"Error fetching balance for wallet {wallet_address}: {status}")
         return 'Error fetching balance'
 
-def get_kas_price() -> float:
-    response = requests.get(KASPA_PRICE_API_URL)
-    if response.status_code == 200:
-        data = response.json()
-        return data.get('price', 0.0)
-    else:
-        logger.error(f"Error fetching KAS price: {response.status_code}")
-        return 0.0
+# Short-lived price cache so hot paths skip the network most of the time
+_price_cache = {'price': 0.0, 'fetched_at': 0.0}
+_price_lock = asyncio.Lock()
+
+async def get_kas_price() -> float:
+    if time.monotonic() - _price_cache['fetched_at'] < PRICE_CACHE_TTL:
+        return _price_cache['price']
+
+    async with _price_lock:
+        # Another caller may have refreshed the cache while we waited on the lock
+        if time.monotonic() - _price_cache['fetched_at'] < PRICE_CACHE_TTL:
+            return _price_cache['price']
+
+        status, body, _ = await api_get(KASPA_PRICE_API_URL)
+        if status == 200:
+            data = orjson.loads(body)
+            _price_cache['price'] = data.get('price', 0.0)
+            _price_cache['fetched_at'] = time.monotonic()
+            return _price_cache['price']
+        else:
+            logger.error(f"Error fetching KAS price: {status}")
+            return 0.0
 
 def format_balance(balance: str) -> str:
     balance = int(balance)
@@ -229,31 +462,40 @@ def format_balance(balance: str) -> str:
     balance_with_decimal = balance_with_decimal[:-2]
     return balance_with_decimal
 
-def get_wallet_transactions(wallet_address: str):
-    response = requests.get(f'{KASPA_API_BASE_URL}/{wallet_address}/full-transactions?limit=10&offset=0&resolve_previous_outpoints=no')
-    if response.status_code == 200:
-        return response.json()
+async def get_wallet_transactions(wallet_address: str):
+    status, body, _ = await api_get(f'{KASPA_API_BASE_URL}/{wallet_address}/full-transactions?limit=10&offset=0&resolve_previous_outpoints=no')
+    if status == 200:
+        return orjson.loads(body)
     else:
-        logger.error(f"Error fetching transactions for wallet {wallet_address}: {response.status_code}")
+        logger.error(f"Error fetching transactions for wallet {wallet_address}: {status}")
         return []
 
-def get_transaction_count(wallet_address: str) -> int:
-    response = requests.get(f'{KASPA_API_BASE_URL}/{wallet_address}/transactions-count')
-    if response.status_code == 200:
-        data = response.json()
-        return data.get('total', 0)  # Ensure we use the correct key
+async def get_transaction_count(wallet_address: str, etag: str = None):
+    """ fetch the transaction count; returns (count, etag), with count None on 304 or error """
+    request_headers = {'If-None-Match': etag} if etag else {}
+    status, body, headers = await api_get(f'{KASPA_API_BASE_URL}/{wallet_address}/transactions-count', headers=request_headers)
+    if status == 304:
+        # Nothing changed upstream, skip the JSON entirely
+        return None, etag
+    elif status == 200:
+        data = orjson.loads(body)
+        return data.get('total', 0), headers.get('ETag')  # Ensure we use the correct key
     else:
-        logger.error(f"Error fetching transaction count for wallet {wallet_address}: {response.status_code}")
-        return 0
+        logger.error(f"Error fetching transaction count for wallet {wallet_address}: {status}")
+        return None, etag
 
-def format_transactions(transactions):
+def format_transactions(transactions, price: float):
     formatted_transactions = ""
-    price = get_kas_price()
     for i, tx in enumerate(transactions):
-        amount = format_balance(sum(output['amount'] for output in tx['outputs']))
-        amount_in_usd = float(amount) * price
+        # Keep the amount in integer sompi until the final formatting step
+        sompi = 0
+        for output in tx['outputs']:
+            sompi += output['amount']
+        amount_in_kas = sompi / 1_0000_0000
+        amount = f"{amount_in_kas:.6f}"
+        amount_in_usd = amount_in_kas * price
         try:
-            time = datetime.fromtimestamp(tx['block_time'] / 1000, tz=timezone.utc).astimezone(pytz.timezone(TIMEZONE)).strftime('%Y-%m-%d %H:%M:%S')
+            time = datetime.fromtimestamp(tx['block_time'] / 1000, tz=timezone.utc).astimezone(_TZ).strftime('%Y-%m-%d %H:%M:%S')
         except Exception as e:
             logger.error(f"Error converting time for transaction {tx['transaction_id']}: {str(e)}")
             time = 'Invalid timestamp'
@@ -264,37 +506,72 @@ def format_transactions(transactions):
         )
     return formatted_transactions
 
-def check_transactions(context: CallbackContext) -> None:
-    job = context.job
-    chat_id = job.data['chat_id']
-    wallet_address = job.data['wallet_address']
-
-    logger.info(f"Checking transactions for wallet: {wallet_address}")
-
-    # Fetch the current transaction count
-    current_transaction_count = get_transaction_count(wallet_address)
-    logger.info(f"Current transaction count for wallet {wallet_address}: {current_transaction_count}")
-
-    # Compare with the last known transaction count
-    if wallet_address in last_transaction_counts and current_transaction_count != last_transaction_counts[wallet_address]:
-        logger.info(f"Transaction count changed for wallet {wallet_address}")
-        # Transaction count has changed, fetch the latest transactions
-        current_transactions = get_wallet_transactions(wallet_address)
-        new_transactions = current_transactions[:1]  # Get the most recent transaction
-
-        if new_transactions:
-            logger.info(f"New transaction detected for wallet {wallet_address}: {new_transactions}")
-            context.bot.send_message(chat_id=chat_id, text=f'New transaction detected:\n{format_transactions(new_transactions)}')
-            last_transactions[wallet_address] = current_transactions
-
-        last_transaction_counts[wallet_address] = current_transaction_count
-    else:
-        logger.info(f"No new transactions for wallet {wallet_address}")
-        last_transaction_counts[wallet_address] = current_transaction_count
+async def check_transactions(context: CallbackContext) -> None:
+    # One global tick: batch every tracked wallet over the shared keep-alive session.
+    # Per-wallet state comes from SQLite, so the tick holds nothing across restarts.
+    async with read_conn() as conn:
+        c = await conn.execute("SELECT DISTINCT wallet_address, last_count, last_tx_id, last_etag FROM wallets")
+        rows = await c.fetchall()
+
+    if not rows:
+        return
+
+    logger.info(f"Checking transactions for {len(rows)} tracked wallet(s)")
+
+    # Fetch all current transaction counts concurrently, conditionally where we hold an ETag
+    counts = await asyncio.gather(*(get_transaction_count(wallet_address, last_etag) for wallet_address, _, _, last_etag in rows), return_exceptions=True)
+
+    state_updates = []
+    for (wallet_address, last_count, last_tx_id, last_etag), result in zip(rows, counts):
+        if isinstance(result, Exception):
+            logger.error(f"Error fetching transaction count for wallet {wallet_address}: {result}")
+            continue
+
+        current_transaction_count, etag = result
+        if current_transaction_count is None:
+            # 304 Not Modified (or a logged fetch error): nothing new for this wallet
+            continue
+
+        # Compare with the last known transaction count
+        if last_count is not None and current_transaction_count != last_count:
+            logger.info(f"Transaction count changed for wallet {wallet_address}")
+            try:
+                # Transaction count has changed, fetch the latest transactions
+                current_transactions = await get_wallet_transactions(wallet_address)
+                new_transactions = current_transactions[:1]  # Get the most recent transaction
+
+                if new_transactions and new_transactions[0]['transaction_id'] == last_tx_id:
+                    # Already notified for this transaction (e.g. by the websocket
+                    # watcher); still fall through to commit the refreshed count
+                    logger.info(f"Most recent transaction for wallet {wallet_address} already notified")
+                elif new_transactions:
+                    logger.info(f"New transaction detected for wallet {wallet_address}: {new_transactions}")
+                    price = await get_kas_price()
+                    text = f'New transaction detected:\n{format_transactions(new_transactions, price)}'
+                    # Notify all subscribers concurrently; one unreachable chat must not stall the tick
+                    results = await asyncio.gather(
+                        *(context.bot.send_message(chat_id=chat_id, text=text) for chat_id in wallet_subscribers.get(wallet_address, ())),
+                        return_exceptions=True,
+                    )
+                    for send_error in (r for r in results if isinstance(r, Exception)):
+                        logger.error(f"Error notifying subscriber of wallet {wallet_address}: {send_error}")
+                    await write_conn.execute("UPDATE wallets SET last_tx_id=? WHERE wallet_address=?",
+                                             (new_transactions[0]['transaction_id'], wallet_address))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # Leave this wallet's state untouched so the next tick retries it;
+                # the wallets already processed still get their state committed below
+                logger.error(f"Error processing new transactions for wallet {wallet_address}: {e}")
+                continue
+
+        state_updates.append((current_transaction_count, etag, wallet_address))
+
+    if state_updates:
+        await write_conn.executemany("UPDATE wallets SET last_count=?, last_etag=? WHERE wallet_address=?", state_updates)
+        await write_conn.commit()
 
 def main() -> None:
     logger.info("Starting bot")
-    application = Application.builder().token(TOKEN).build()
+    application = Application.builder().token(TOKEN).post_init(on_startup).post_shutdown(on_shutdown).build()
 
     application.add_handler(CommandHandler('start', start))
     application.add_handler(CommandHandler('help', help_command))
@@ -304,6 +581,10 @@ def main() -> None:
     application.add_handler(CommandHandler('list_wallets', list_wallets))
     application.add_handler(CommandHandler('history', history))
 
+    # One global job polls every tracked wallet instead of one job per wallet
+    application.job_queue.run_repeating(check_transactions, interval=POLLING_INTERVAL, first=POLLING_INTERVAL)
+    logger.info("Scheduled global job to check transactions for all tracked wallets")
+
     application.run_polling()
     logger.info("Bot started with polling")
 